@@ -1,24 +1,67 @@
+import hmac
+import json
 import os
+import orjson
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from functools import wraps
 
+# Load environment variables from .env file before importing the services,
+# which read their configuration when they are imported
+load_dotenv()
+
 # Import services
+from cache_service import get_cached_analyses, store_analyses
 from kt_service import trace_student_knowledge
 from llm_service import (
-    generate_solution_steps_for_question,
-    classify_bloom_level_for_question,
-    generate_embedding_for_text,
-    extract_taxonomy_tags_for_text,
+    a_generate_solution_steps,
+    a_classify_bloom_level,
+    a_generate_embeddings,
+    a_extract_tags,
+    a_summarize_contents,
+    run_concurrently,
+    analyze_questions_batch,
+    quantize_int8,
+    encode_float32_b64,
+    warmup,
+    analysis_model_id,
     generate_feedback_with_graphrag_llm,
-    summarize_content,
+    stream_feedback_with_graphrag_llm,
+    submit_graphrag_retrieval,
     update_graph_with_new_data
 )
 
-# Load environment variables from .env file
-load_dotenv()
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider that encodes responses with orjson, which handles the large float lists of
+    analyze_course_content in C and serializes numpy arrays directly. Request bodies are still
+    parsed by the default (stdlib) provider, which accepts NaN and arbitrarily large integers.
+    """
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    @staticmethod
+    def default(o):
+        if hasattr(o, "tolist"): # numpy arrays/scalars on the stdlib fallback path
+            return o.tolist()
+        return DefaultJSONProvider.default(o)
+
+    def _encode(self, obj):
+        try:
+            return orjson.dumps(obj, default=DefaultJSONProvider.default, option=self.option)
+        except orjson.JSONEncodeError:
+            # e.g. an echoed integer ID beyond 64 bits; the stdlib encoder handles it
+            return super().dumps(obj).encode()
+
+    def dumps(self, obj, **kwargs):
+        return self._encode(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj), mimetype="application/json")
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 # Basic logging configuration for Flask app
 if not app.debug: # Avoid duplicate handlers if Flask's debug reloader is active
     import logging
@@ -32,6 +75,16 @@ if not LMS_API_KEY:
     app.logger.error("LMS_PLUGIN_API_KEY not found in environment variables.")
     raise ValueError("LMS_PLUGIN_API_KEY not found in environment variables.")
 
+_API_KEY_BYTES = LMS_API_KEY.encode()
+_BEARER_AUTH_TYPE = 'bearer'
+
+# Load and exercise the models before serving, keeping model-load latency out of the first request
+with app.app_context():
+    try:
+        warmup()
+    except Exception as e:
+        app.logger.error(f"Model warmup failed: {e}", exc_info=True)
+
 # --- API Key Authentication Decorator ---
 def require_api_key(f):
     @wraps(f)
@@ -44,24 +97,54 @@ def require_api_key(f):
         if not LMS_API_KEY: 
             app.logger.error("API Key is not configured on the server (LMS_PLUGIN_API_KEY missing).")
             return jsonify({"status": "error", "message": "API Key not configured on server"}), 500
-        try:
-            auth_type, api_key_received = auth_header.split()
-            if auth_type.lower() != 'bearer' or api_key_received != LMS_API_KEY:
-                app.logger.warning(f"Invalid API Key. Received type: {auth_type}")
-                return jsonify({"status": "error", "message": "Invalid API Key"}), 401
-        except ValueError:
-            app.logger.warning(f"Invalid Authorization Header format. Header: {auth_header}")
+        parts = auth_header.split(None, 1) # Any whitespace separates scheme and key, as with split()
+        if len(parts) != 2:
+            app.logger.warning("Invalid Authorization Header format.")
             return jsonify({"status": "error", "message": "Invalid Authorization Header format"}), 401
+        auth_type, api_key_received = parts
+        # Constant-time comparison so response timing does not leak the key
+        if auth_type.lower() != _BEARER_AUTH_TYPE or not hmac.compare_digest(_API_KEY_BYTES, api_key_received.strip().encode()):
+            app.logger.warning("Invalid API Key. Received type: %s", auth_type)
+            return jsonify({"status": "error", "message": "Invalid API Key"}), 401
         return f(*args, **kwargs)
     return decorated_function
 
+def _wants_event_stream():
+    """True if the client asked for a Server-Sent Events response (Accept header or ?stream=1)."""
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+def _sse_event(payload, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(payload)}\n\n"
+
+def _format_embedding(embedding):
+    """
+    Encodes an embedding for the response: ?quant=int8 returns the quantized form,
+    ?encoding=b64 the lossless base64 float32 form, otherwise a plain list of floats.
+    """
+    if request.args.get('quant') == 'int8':
+        return quantize_int8(embedding)
+    if request.args.get('encoding') == 'b64':
+        return encode_float32_b64(embedding)
+    return embedding
+
+def _get_request_data():
+    """
+    Parses the JSON body once (cached on the request) and logs it lazily at DEBUG,
+    so large course payloads are never stringified unless debug logging is enabled.
+    """
+    data = request.get_json(cache=True)
+    app.logger.debug("Received data for %s: %s", request.path, data)
+    return data
+
 # --- API Endpoints ---
 
 @app.route('/api/generate_feedback', methods=['POST'])
 @require_api_key
 def generate_feedback():
-    data = request.json
-    app.logger.info(f"Received data for /api/generate_feedback: {data}")
+    data = _get_request_data()
 
     try:
         attempt_id = data.get('attemptid')
@@ -80,14 +163,16 @@ def generate_feedback():
         if not all([attempt_id, user_id, course_id, quiz_id]): # quiz_id is also important context
             return jsonify({"status": "error", "message": "Missing required fields: attemptid, userid, courseid, or quizid"}), 400
 
-        # 1. Perform Knowledge Tracing
-        student_kt_state = trace_student_knowledge(user_id, course_id, responses, history, content_views)
-
-        # 2. Prepare context for GraphRAG/LLM (can be expanded)
+        # 1. Prepare context for GraphRAG/LLM (can be expanded)
         #    For now, we'll pass the attempt data and KT state.
         #    You might also fetch relevant course learning objectives or content metadata here.
         course_context_for_llm = {"course_id": course_id} # Add more course-specific details if needed
 
+        # 2. Start GraphRAG retrieval in the background, then perform Knowledge Tracing.
+        #    The feedback generator only waits on retrieval after prefilling the KT-dependent prompt prefix.
+        graphrag_context = submit_graphrag_retrieval(data, course_context_for_llm)
+        student_kt_state = trace_student_knowledge(user_id, course_id, responses, history, content_views)
+
         # 3. Generate feedback using GraphRAG and LLM
         # Pass the original 'data' (which now includes quizname) or pass quiz_name explicitly
         # Let's assume generate_feedback_with_graphrag_llm can now accept quiz_name
@@ -102,7 +187,23 @@ def generate_feedback():
         # This is simpler if you don't want to change the function signature immediately,
         # assuming generate_feedback_with_graphrag_llm is designed to look for 'quizname' in its first 'data' argument.
         # The 'data' dictionary already contains 'quizname' because Moodle now sends it.
-        feedback_text = generate_feedback_with_graphrag_llm(data, student_kt_state, course_context_for_llm)
+        if _wants_event_stream():
+            # Stream chunks as the LLM emits them so the client sees the first tokens right away
+            chunks = stream_feedback_with_graphrag_llm(data, student_kt_state, course_context_for_llm, graphrag_context)
+
+            def generate():
+                try:
+                    for chunk in chunks:
+                        yield _sse_event({"feedback": chunk})
+                    yield _sse_event({"status": "success"}, event="done")
+                except Exception as e:
+                    app.logger.error(f"Error while streaming /api/generate_feedback: {e}", exc_info=True)
+                    yield _sse_event({"status": "error", "message": "An internal error occurred while generating feedback."}, event="error")
+
+            return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        feedback_text = generate_feedback_with_graphrag_llm(data, student_kt_state, course_context_for_llm, graphrag_context)
         
         return jsonify({
             "status": "success",
@@ -115,8 +216,7 @@ def generate_feedback():
 @app.route('/api/analyze_question', methods=['POST'])
 @require_api_key
 def analyze_question():
-    data = request.json
-    app.logger.info(f"Received data for /api/analyze_question: {data}")
+    data = _get_request_data()
 
     try:
         question_data = data.get('question', {})
@@ -128,22 +228,21 @@ def analyze_question():
         if not all([question_id, question_text, question_type]):
              return jsonify({"status": "error", "message": "Missing required question fields: id, text, or type"}), 400
 
-        # 1. Generate solution steps
-        solution_steps = generate_solution_steps_for_question(question_text, question_type, answers)
-
-        # 2. Classify Bloom's Taxonomy level
-        cognitive_level = classify_bloom_level_for_question(question_text, answers)
-
-        # 3. Generate semantic embedding
-        embedding = generate_embedding_for_text(question_text)
-        
-        # 4. Extract taxonomy tags (keywords, concepts)
-        taxonomy_tags = extract_taxonomy_tags_for_text(question_text)
+        # Solution steps, Bloom's level, semantic embedding and taxonomy tags (keywords, concepts)
+        # are independent model calls, so run them concurrently.
+        solution_steps, cognitive_level, embeddings, tags = run_concurrently(
+            a_generate_solution_steps(question_text, question_type, answers),
+            a_classify_bloom_level(question_text, answers),
+            a_generate_embeddings([question_text]),
+            a_extract_tags([question_text])
+        )
+        embedding = embeddings[0]
+        taxonomy_tags = tags[0]
 
         return jsonify({
             "status": "success",
             "question_id": question_id, # Echo back the question ID for mapping
-            "embedding": embedding,
+            "embedding": _format_embedding(embedding),
             "cognitive_level": cognitive_level, # e.g., "Applying" or an integer code
             "solution_steps": solution_steps,   # List of strings
             "taxonomy": taxonomy_tags           # List of dicts: [{"name": "Skill", "type": "skill"}, ...]
@@ -152,54 +251,99 @@ def analyze_question():
         app.logger.error(f"Error in /api/analyze_question: {e}", exc_info=True)
         return jsonify({"status": "error", "message": "An internal error occurred while analyzing the question."}), 500
 
+@app.route('/api/analyze_questions_batch', methods=['POST'])
+@require_api_key
+def analyze_questions_batch_endpoint():
+    data = _get_request_data()
+
+    try:
+        questions = data.get('questions', [])
+        for question_data in questions:
+            if not all([question_data.get('id'), question_data.get('text'), question_data.get('type')]):
+                return jsonify({"status": "error", "message": "Missing required question fields: id, text, or type"}), 400
+
+        # Similar questions share one LLM prefill (see llm_service.analyze_questions_batch)
+        analyzed_questions = analyze_questions_batch(questions) if questions else []
+        for analyzed in analyzed_questions:
+            analyzed["embedding"] = _format_embedding(analyzed["embedding"])
+
+        return jsonify({
+            "status": "success",
+            "questions": analyzed_questions # Same fields as /api/analyze_question, one entry per question
+        })
+    except Exception as e:
+        app.logger.error(f"Error in /api/analyze_questions_batch: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": "An internal error occurred while analyzing the questions."}), 500
+
 @app.route('/api/analyze_course_content', methods=['POST'])
 @require_api_key
 def analyze_course_content():
-    data = request.json
-    app.logger.info(f"Received data for /api/analyze_course_content: {data}")
+    data = _get_request_data()
 
     try:
         # course_id = data.get('courseid') # Available if needed for context
         books_data = data.get('books', [])
         h5p_transcripts_data = data.get('h5p_transcripts', [])
 
-        analyzed_book_chapters = []
+        # 1. Gather every (kind, id, text) item up front so the models can be called in batches
+        items = []
         for book in books_data:
             for chapter in book.get('chapters', []):
                 chapter_id = chapter.get('chapterid')
                 content = chapter.get('content')
                 if not all([chapter_id, content]):
-                    app.logger.warning(f"Skipping chapter due to missing ID or content: {chapter}")
+                    app.logger.warning("Skipping chapter due to missing ID or content: %s", chapter)
                     continue
-                
-                summary = summarize_content(content)
-                tags = extract_taxonomy_tags_for_text(content)
-                embedding = generate_embedding_for_text(content) # Also generate embedding for content
-                analyzed_book_chapters.append({
-                    "chapterid": chapter_id,
-                    "summary": summary,
-                    "taxonomy": tags,
-                    "embedding": embedding 
-                })
+                items.append(("chapterid", chapter_id, content))
 
-        analyzed_h5p_activities = []
         for h5p in h5p_transcripts_data:
             h5p_id = h5p.get('h5pid')
             transcript = h5p.get('transcript')
             if not all([h5p_id, transcript]):
-                app.logger.warning(f"Skipping H5P due to missing ID or transcript: {h5p}")
+                app.logger.warning("Skipping H5P due to missing ID or transcript: %s", h5p)
                 continue
+            items.append(("h5pid", h5p_id, transcript))
+
+        # 2. Deduplicate identical texts (e.g. an H5P transcript repeating a chapter) and skip texts
+        #    already analyzed in an earlier sync (on-disk cache keyed by content hash + model version)
+        texts = [text for _, _, text in items]
+        unique_texts = list(dict.fromkeys(texts))
+        results_by_text = get_cached_analyses(unique_texts, analysis_model_id())
+        missing_texts = [text for text in unique_texts if text not in results_by_text]
+        app.logger.info("Analyzing course content: %d books, %d H5P transcripts, %d items (%d unique, %d uncached, %d chars)",
+                        len(books_data), len(h5p_transcripts_data), len(texts), len(unique_texts),
+                        len(missing_texts), sum(len(text) for text in missing_texts))
+
+        # 3. One batched call per model over the remaining texts, all three running concurrently
+        if missing_texts:
+            summaries, tags, embeddings = run_concurrently(
+                a_summarize_contents(missing_texts),
+                a_extract_tags(missing_texts),
+                a_generate_embeddings(missing_texts)
+            )
+            new_results = {
+                text: {"summary": summary, "taxonomy": item_tags, "embedding": embedding}
+                for text, summary, item_tags, embedding in zip(missing_texts, summaries, tags, embeddings)
+            }
+            store_analyses(new_results, analysis_model_id())
+            results_by_text.update(new_results)
+
+        # 4. Fan the results back out to every chapter/H5P that owns the text
+        analyzed_book_chapters = []
+        analyzed_h5p_activities = []
+        for kind, item_id, text in items:
+            result = results_by_text[text]
+            analyzed = {
+                kind: item_id,
+                "summary": result["summary"],
+                "taxonomy": result["taxonomy"],
+                "embedding": _format_embedding(result["embedding"])
+            }
+            if kind == "chapterid":
+                analyzed_book_chapters.append(analyzed)
+            else:
+                analyzed_h5p_activities.append(analyzed)
 
-            summary = summarize_content(transcript)
-            tags = extract_taxonomy_tags_for_text(transcript)
-            embedding = generate_embedding_for_text(transcript) # Also generate embedding for content
-            analyzed_h5p_activities.append({
-                "h5pid": h5p_id,
-                "summary": summary,
-                "taxonomy": tags,
-                "embedding": embedding
-            })
-            
         return jsonify({
             "status": "success",
             "bookchapters": analyzed_book_chapters,
@@ -212,11 +356,13 @@ def analyze_course_content():
 @app.route('/api/update_knowledge_graph', methods=['POST'])
 @require_api_key
 def update_knowledge_graph():
-    data = request.json # Expects data from analyze_course_content and analyze_question
-    app.logger.info(f"Received data for /api/update_knowledge_graph: {data}")
+    data = _get_request_data() # Expects data from analyze_course_content and analyze_question
 
     try:
         course_id = data.get('courseid')
+        if not course_id:
+            # Stored item hashes are per course; without an ID unrelated syncs would diff against each other
+            return jsonify({"status": "error", "message": "Missing required field: courseid"}), 400
         # The Moodle plugin currently sends analyzed content directly.
         # If you change Moodle to send raw content and want this endpoint to trigger analysis first,
         # you'd call analyze_course_content and analyze_question logic here.
@@ -257,4 +403,5 @@ def update_knowledge_graph():
         return jsonify({"status": "error", "message": "An internal error occurred while updating the knowledge graph."}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Development server only; in production run `gunicorn app:app` (see gunicorn.conf.py).
+    app.run(debug=os.getenv("FLASK_DEBUG") == "1", threaded=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+# Configure logging for the cache service
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# On-disk store of content analysis results, shared by all worker processes and kept across restarts.
+# Set ANALYSIS_CACHE_PATH to an empty string to disable it.
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", "analysis_cache.sqlite3")
+
+_local = threading.local()
+
+def _get_connection():
+    """Returns this thread's SQLite connection, creating the schema on first use."""
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        connection = sqlite3.connect(ANALYSIS_CACHE_PATH, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS content_analysis ("
+            " key TEXT PRIMARY KEY, summary TEXT, taxonomy TEXT, embedding BLOB)"
+        )
+        connection.commit()
+        _local.connection = connection
+    return connection
+
+def content_cache_key(text_content, model_id):
+    """Content-hash key for a text analyzed by the models identified by model_id."""
+    return hashlib.blake2b(text_content.encode() + b"\0" + model_id.encode(), digest_size=16).hexdigest()
+
+def get_cached_analyses(texts, model_id):
+    """
+    Looks up stored analysis results for texts produced by the models identified by model_id
+    (see llm_service.analysis_model_id).
+
+    Returns:
+        dict: text -> {"summary": str, "taxonomy": list, "embedding": np.ndarray} for every cache hit.
+    """
+    if not ANALYSIS_CACHE_PATH or not texts:
+        return {}
+    keys = {content_cache_key(text, model_id): text for text in texts}
+    hits = {}
+    try:
+        connection = _get_connection()
+        key_list = list(keys)
+        for start in range(0, len(key_list), 500): # Stay below SQLite's bound-parameter limit
+            chunk = key_list[start:start + 500]
+            rows = connection.execute(
+                f"SELECT key, summary, taxonomy, embedding FROM content_analysis WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            for key, summary, taxonomy, embedding in rows:
+                hits[keys[key]] = {
+                    "summary": summary,
+                    "taxonomy": json.loads(taxonomy),
+                    "embedding": np.frombuffer(embedding, dtype=np.float32)
+                }
+    except sqlite3.Error as e:
+        logger.warning(f"Analysis cache lookup failed: {e}")
+    logger.info(f"Analysis cache: {len(hits)} of {len(keys)} texts found.")
+    return hits
+
+def store_analyses(results_by_text, model_id):
+    """
+    Stores analysis results.
+
+    Args:
+        results_by_text (dict): text -> {"summary": str, "taxonomy": list, "embedding": array-like}.
+        model_id (str): Identity of the models that produced the results.
+    """
+    if not ANALYSIS_CACHE_PATH or not results_by_text:
+        return
+    rows = [
+        (
+            content_cache_key(text, model_id),
+            result["summary"],
+            json.dumps(result["taxonomy"]),
+            np.asarray(result["embedding"], dtype=np.float32).tobytes()
+        )
+        for text, result in results_by_text.items()
+    ]
+    try:
+        connection = _get_connection()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO content_analysis VALUES (?, ?, ?, ?)", rows)
+    except sqlite3.Error as e:
+        logger.warning(f"Analysis cache store failed: {e}")
@@ -0,0 +1,67 @@
+import logging
+import os
+import sqlite3
+import threading
+
+# Configure logging for the graph state service
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Durable record of which content hashes the knowledge graph currently reflects, per course.
+# Unlike the analysis cache this is not disposable: losing it means deletions are never reported
+# to GraphRAG, so it has its own file and cannot be disabled.
+GRAPH_STATE_PATH = os.getenv("GRAPH_STATE_PATH", "graph_state.sqlite3")
+
+_local = threading.local()
+
+def _get_connection():
+    """Returns this thread's SQLite connection, creating the schema on first use."""
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        connection = sqlite3.connect(GRAPH_STATE_PATH, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS course_items ("
+            " course_id TEXT, item_key TEXT, content_hash TEXT, PRIMARY KEY (course_id, item_key))"
+        )
+        connection.commit()
+        _local.connection = connection
+    return connection
+
+def diff_course_items(course_id, item_hashes, item_kinds):
+    """
+    Compares a course's incoming items against the content hashes stored at the last graph update.
+
+    Args:
+        course_id: The course the items belong to.
+        item_hashes (dict): item key ("<kind>:<id>") -> content hash.
+        item_kinds (set): Kinds the caller sent a full list for; stored items of other kinds are
+                          never reported as removed, since they were simply not part of this sync.
+
+    Returns:
+        tuple: (added, changed, removed) lists of item keys.
+    """
+    rows = _get_connection().execute(
+        "SELECT item_key, content_hash FROM course_items WHERE course_id = ?", (str(course_id),)
+    )
+    stored = dict(rows)
+    added = [key for key in item_hashes if key not in stored]
+    changed = [key for key, content_hash in item_hashes.items() if key in stored and stored[key] != content_hash]
+    removed = [
+        key for key in stored
+        if key not in item_hashes and key.split(":", 1)[0] in item_kinds
+    ]
+    return added, changed, removed
+
+def save_course_items(course_id, item_hashes, removed):
+    """Records the content hashes the knowledge graph now reflects for a course."""
+    connection = _get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO course_items VALUES (?, ?, ?)",
+            [(str(course_id), key, content_hash) for key, content_hash in item_hashes.items()]
+        )
+        connection.executemany(
+            "DELETE FROM course_items WHERE course_id = ? AND item_key = ?",
+            [(str(course_id), key) for key in removed]
+        )
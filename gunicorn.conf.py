@@ -0,0 +1,38 @@
+# Gunicorn configuration: `gunicorn app:app` picks this file up automatically.
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+# Same .env the app loads, so worker sizing sees the same configuration
+load_dotenv()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Several worker processes, each serving requests on a pool of threads, so analysis and
+# feedback requests from Moodle overlap while they wait on model calls.
+# Every worker loads its own copy of LOCAL_EMBEDDING_MODEL during warmup (one CUDA context and
+# model copy per worker), so with a GPU-resident model default to a single worker and rely on its
+# threads; raise WEB_CONCURRENCY only as far as GPU memory allows.
+def _local_embedder_on_gpu():
+    """Same device rule as llm_service._get_local_embedder: EMBEDDING_DEVICE, else CUDA if available."""
+    if not os.getenv("LOCAL_EMBEDDING_MODEL"):
+        return False
+    device = os.getenv("EMBEDDING_DEVICE")
+    if device:
+        return device.startswith("cuda")
+    # The NVML-based check does not initialize CUDA in the master process before the workers fork
+    os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")
+    import torch
+    return torch.cuda.is_available()
+
+if os.getenv("WEB_CONCURRENCY"):
+    workers = int(os.getenv("WEB_CONCURRENCY"))
+elif _local_embedder_on_gpu():
+    workers = 1
+else:
+    workers = multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+# Content analysis of a whole course can take a while.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
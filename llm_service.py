@@ -1,11 +1,194 @@
+import asyncio
+import base64
+import hashlib
+import json
 import logging
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from graph_state_service import diff_course_items, save_course_items
 
 # Configure logging for the LLM service
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# --- Content-hash keyed LRU caches for model outputs ---
+
+class TextHashLRUCache:
+    """
+    Small thread-safe LRU cache keyed by the SHA256 digest of a text.
+    Texts (chapters, transcripts) can be long, so the raw text is never used as a key.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(text_content):
+        return hashlib.sha256(text_content.encode()).digest()
+
+    def get(self, text_content):
+        key = self.key_for(text_content)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, text_content, value):
+        key = self.key_for(text_content)
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+_EMBEDDING_CACHE = TextHashLRUCache(maxsize=1024)
+_TAXONOMY_CACHE = TextHashLRUCache(maxsize=1024)
+_SUMMARY_CACHE = TextHashLRUCache(maxsize=1024)
+
+def get_cached_embedder():
+    """Returns the process-wide embedding cache shared by all requests."""
+    return _EMBEDDING_CACHE
+
+def _lookup_or_compute(cache, texts, batch_fn):
+    """
+    Resolves each text from the cache and computes all misses with a single
+    call to batch_fn(list_of_texts), which must return results in the same order.
+    """
+    results = [cache.get(text) for text in texts]
+    missing = list(dict.fromkeys(text for text, result in zip(texts, results) if result is None))
+    if missing:
+        computed = dict(zip(missing, batch_fn(missing)))
+        for text, result in computed.items():
+            cache.put(text, result)
+        results = [computed[text] if result is None else result for text, result in zip(texts, results)]
+    return results
+
+# --- Downstream model services ---
+
+# Optional embedding service with an Ollama-style batch endpoint (POST {"model", "input": [...]}
+# -> {"embeddings": [...]}), e.g. http://localhost:11434/api/embed. Dummy embeddings are used if unset.
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+MODEL_SERVICE_TIMEOUT = float(os.getenv("MODEL_SERVICE_TIMEOUT", "60"))
+
+def _create_http_session():
+    """One keep-alive connection pool shared by all downstream model calls, instead of a new TCP/TLS connection per call."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_HTTP = _create_http_session()
+
+def _post_json(url, payload):
+    response = _HTTP.post(url, json=payload, timeout=MODEL_SERVICE_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+# Optional in-process SentenceTransformer embedding model (e.g. BAAI/bge-small-en), placed on the GPU
+# when one is available. EMBEDDING_COMPILE=1 additionally compiles the transformer with torch.compile.
+# Each Gunicorn worker loads its own copy at warmup; gunicorn.conf.py therefore defaults to one worker
+# when this model is on the GPU. Results are cached under analysis_model_id(), which names this model.
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE")
+EMBEDDING_COMPILE = os.getenv("EMBEDDING_COMPILE") == "1"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# Version of the summary/tag models (still placeholders); bump it when they change.
+MODEL_VERSION = os.getenv("MODEL_VERSION", "placeholder-v1")
+
+def analysis_model_id():
+    """
+    Identifies the models behind content analysis results: the embedding backend actually in use
+    (same precedence as `_embed_texts`) plus MODEL_VERSION. Part of every on-disk cache key, so
+    results from another backend or embedding model are never served.
+    """
+    if LOCAL_EMBEDDING_MODEL:
+        embedder = f"local:{LOCAL_EMBEDDING_MODEL}"
+    elif EMBEDDING_SERVICE_URL:
+        embedder = f"http:{EMBEDDING_MODEL}"
+    else:
+        embedder = f"dummy:{EMBEDDING_DIM}"
+    return f"{embedder}|{MODEL_VERSION}"
+
+_local_embedder = None
+_local_embedder_lock = threading.Lock()
+
+def _get_local_embedder():
+    """Loads LOCAL_EMBEDDING_MODEL once per process (normally during warmup)."""
+    global _local_embedder
+    with _local_embedder_lock:
+        if _local_embedder is None:
+            # Heavy optional dependencies, only needed when a local model is configured
+            import torch
+            from sentence_transformers import SentenceTransformer
+
+            device = EMBEDDING_DEVICE or ("cuda" if torch.cuda.is_available() else "cpu")
+            logger.info(f"Loading embedding model {LOCAL_EMBEDDING_MODEL} on {device}.")
+            model = SentenceTransformer(LOCAL_EMBEDDING_MODEL, device=device)
+            if device.startswith("cuda"):
+                model.half() # fp16 runs on the tensor cores
+            if EMBEDDING_COMPILE:
+                # Compile the underlying transformer; .encode() keeps its own batching/pooling
+                model[0].auto_model = torch.compile(model[0].auto_model, mode="reduce-overhead", dynamic=True)
+            _local_embedder = model
+        return _local_embedder
+
+# --- Concurrent dispatch of blocking model calls ---
+
+# Caps how many model calls run at once across all requests (like OLLAMA_NUM_PARALLEL).
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+_LLM_EXECUTOR = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+
+# GraphRAG retrieval is not a model call, so it gets its own pool and never queues behind model batches.
+GRAPHRAG_MAX_CONCURRENCY = int(os.getenv("GRAPHRAG_MAX_CONCURRENCY", "8"))
+_RETRIEVAL_EXECUTOR = ThreadPoolExecutor(max_workers=GRAPHRAG_MAX_CONCURRENCY, thread_name_prefix="graphrag")
+
+async def _run_in_llm_executor(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_LLM_EXECUTOR, fn, *args)
+
+def run_concurrently(*coroutines):
+    """
+    Runs independent async model calls concurrently from synchronous (Flask) code
+    and returns their results in order.
+    """
+    async def _gather():
+        return await asyncio.gather(*coroutines)
+    return asyncio.run(_gather())
+
 # --- Placeholder functions for ML/LLM model interactions ---
 
+# Question-independent steps of the dummy solution, plus the extra final step per question type.
+_BASE_SOLUTION_STEPS = (
+    "Step 2: Identify key information and formulas.",
+    "Step 3: Apply the method/formula.",
+    "Step 4: Calculate the result and verify."
+)
+_EXTRA_SOLUTION_STEPS = {
+    "multichoice": ("Step 5: Select the correct option from the choices.",),
+}
+
 def generate_solution_steps_for_question(question_text, question_type, answers):
     """
     Generates step-by-step solutions for a given question.
@@ -13,15 +196,30 @@ def generate_solution_steps_for_question(question_text, question_type, answers):
     """
     logger.info(f"Generating solution steps for question: {question_text[:50]}...")
     # Dummy implementation
-    steps = [
+    return [
         f"Step 1: Understand the question: '{question_text[:30]}...'",
-        "Step 2: Identify key information and formulas.",
-        "Step 3: Apply the method/formula.",
-        "Step 4: Calculate the result and verify."
+        *_BASE_SOLUTION_STEPS,
+        *(_EXTRA_SOLUTION_STEPS.get(question_type, ()) if isinstance(question_type, str) else ())
     ]
-    if question_type == "multichoice":
-        steps.append("Step 5: Select the correct option from the choices.")
-    return steps
+
+EMBEDDING_DIM = 128
+_RNG = np.random.default_rng() # Backs the dummy embeddings
+
+_BLOOM_LEVELS = {"Remembering": 1, "Understanding": 2, "Applying": 3, "Analyzing": 4, "Evaluating": 5, "Creating": 6}
+# Keyword -> Bloom level for the keyword heuristic; the lowest matching level wins.
+_BLOOM_KEYWORD_LEVELS = {
+    "define": _BLOOM_LEVELS["Remembering"],
+    "list": _BLOOM_LEVELS["Remembering"],
+    "explain": _BLOOM_LEVELS["Understanding"],
+    "summarize": _BLOOM_LEVELS["Understanding"],
+    "calculate": _BLOOM_LEVELS["Applying"],
+    "solve": _BLOOM_LEVELS["Applying"],
+    "apply": _BLOOM_LEVELS["Applying"],
+}
+# One pass over the lowercased text finds every keyword occurrence (the lookahead allows overlaps).
+_BLOOM_KEYWORD_PATTERN = re.compile(
+    "(?=(" + "|".join(re.escape(keyword) for keyword in _BLOOM_KEYWORD_LEVELS) + "))"
+)
 
 def classify_bloom_level_for_question(question_text, answers):
     """
@@ -32,84 +230,292 @@ def classify_bloom_level_for_question(question_text, answers):
     logger.info(f"Classifying Bloom's level for question: {question_text[:50]}...")
     # Dummy implementation - randomly assign or use a simple heuristic
     # In reality, this would be a call to a trained classifier.
-    levels = {"Remembering": 1, "Understanding": 2, "Applying": 3, "Analyzing": 4, "Evaluating": 5, "Creating": 6}
     # Simple heuristic based on keywords (very basic)
-    if "define" in question_text.lower() or "list" in question_text.lower():
-        return levels["Remembering"]
-    if "explain" in question_text.lower() or "summarize" in question_text.lower():
-        return levels["Understanding"]
-    if "calculate" in question_text.lower() or "solve" in question_text.lower() or "apply" in question_text.lower():
-        return levels["Applying"]
-    return levels["Applying"] # Default
+    level = _BLOOM_LEVELS["Applying"] # Default
+    for match in _BLOOM_KEYWORD_PATTERN.finditer(question_text.lower()):
+        level = min(level, _BLOOM_KEYWORD_LEVELS[match.group(1)])
+        if level == _BLOOM_LEVELS["Remembering"]:
+            break
+    return level
+
+def _embed_texts(texts):
+    """
+    Generates semantic embeddings for a batch of texts in one model call,
+    via LOCAL_EMBEDDING_MODEL or EMBEDDING_SERVICE_URL if configured.
+    (Placeholder - implement with your embedding model's batch API)
+    """
+    logger.info(f"Generating embeddings for {len(texts)} text(s) in one batch.")
+    if LOCAL_EMBEDDING_MODEL:
+        embeddings = _get_local_embedder().encode(texts, batch_size=EMBEDDING_BATCH_SIZE, convert_to_numpy=True)
+        return list(embeddings.astype(np.float32, copy=False))
+    if EMBEDDING_SERVICE_URL:
+        result = _post_json(EMBEDDING_SERVICE_URL, {"model": EMBEDDING_MODEL, "input": texts})
+        return list(np.asarray(result["embeddings"], dtype=np.float32))
+    # Dummy implementation - replace with your actual embedding model call
+    # Example: return my_sentence_transformer_model.encode(texts, batch_size=32).tolist()
+    # Rows stay float32 ndarrays; the app's orjson provider serializes them directly.
+    return list(_RNG.random((len(texts), EMBEDDING_DIM), dtype=np.float32)) # Example 128-dim embeddings
+
+def generate_embeddings_for_texts(texts):
+    """
+    Generates semantic embeddings for a list of texts, batching all cache misses
+    into a single call to the embedding backend.
+    """
+    return _lookup_or_compute(_EMBEDDING_CACHE, texts, _embed_texts)
 
 def generate_embedding_for_text(text_content):
     """
     Generates a semantic embedding for text content.
-    (Placeholder - implement with your embedding model)
     """
     logger.info(f"Generating embedding for text: {text_content[:50]}...")
-    # Dummy implementation - replace with your actual embedding model call
-    # Example: return my_sentence_transformer_model.encode(text_content).tolist()
-    import random
-    return [random.random() for _ in range(128)] # Example 128-dim embedding
+    return generate_embeddings_for_texts([text_content])[0]
 
-def extract_taxonomy_tags_for_text(text_content):
+def encode_float32_b64(embedding):
     """
-    Extracts taxonomy tags (keywords, concepts, skills) from text.
-    (Placeholder - implement with your model)
+    Encodes an embedding losslessly as base64 of its raw float32 bytes, far smaller than a JSON number array.
+
+    Returns:
+        dict: {"dtype": "float32", "shape": [dim], "values": base64 of the float32 bytes}.
+              Decode with: np.frombuffer(base64.b64decode(values), dtype=np.float32)
     """
-    logger.info(f"Extracting taxonomy tags for text: {text_content[:50]}...")
+    vector = np.ascontiguousarray(embedding, dtype=np.float32)
+    return {
+        "dtype": "float32",
+        "shape": list(vector.shape),
+        "values": base64.b64encode(vector.tobytes()).decode()
+    }
+
+def quantize_int8(embedding):
+    """
+    Quantizes an embedding to int8 with a per-vector affine scale to shrink API payloads.
+
+    Returns:
+        dict: {"dtype": "int8", "scale": float, "offset": float, "values": base64 of the int8 bytes}.
+              Dequantize with:
+                  (np.frombuffer(base64.b64decode(values), dtype=np.int8).astype(np.float32) + 128) * scale + offset
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    offset = float(vector.min())
+    scale = float(vector.max() - offset) / 255
+    if scale > 0:
+        quantized = np.round((vector - offset) / scale - 128)
+    else:
+        quantized = np.full(vector.shape, -128)
+    return {
+        "dtype": "int8",
+        "scale": scale,
+        "offset": offset,
+        "values": base64.b64encode(quantized.astype(np.int8).tobytes()).decode()
+    }
+
+# Lowercase keyword -> tag table for the dummy tag extractor.
+_TAXONOMY_KEYWORD_TAGS = (
+    ("algebra", {"name": "Algebra", "type": "topic"}),
+    ("solving equations", {"name": "Equation Solving", "type": "skill"}),
+)
+_DEFAULT_TAXONOMY_TAG = {"name": "General Knowledge", "type": "topic"}
+
+def _extract_taxonomy_tags(text_content):
     # Dummy implementation
-    tags = []
-    if "algebra" in text_content.lower():
-        tags.append({"name": "Algebra", "type": "topic"})
-    if "solving equations" in text_content.lower():
-        tags.append({"name": "Equation Solving", "type": "skill"})
+    lowered = text_content.lower()
+    tags = [dict(tag) for keyword, tag in _TAXONOMY_KEYWORD_TAGS if keyword in lowered]
     if not tags:
-        tags.append({"name": "General Knowledge", "type": "topic"})
+        tags.append(dict(_DEFAULT_TAXONOMY_TAG))
     return tags
 
-def generate_feedback_with_graphrag_llm(attempt_data, student_kt_state, course_context):
+def extract_taxonomy_tags_for_texts(texts):
     """
-    Generates personalized feedback using GraphRAG and an LLM.
+    Extracts taxonomy tags for a list of texts, batching all cache misses.
+    (Placeholder - implement with your model)
+    """
+    return _lookup_or_compute(
+        _TAXONOMY_CACHE, texts, lambda batch: [_extract_taxonomy_tags(text) for text in batch]
+    )
+
+def extract_taxonomy_tags_for_text(text_content):
+    """
+    Extracts taxonomy tags (keywords, concepts, skills) from text.
+    """
+    logger.info(f"Extracting taxonomy tags for text: {text_content[:50]}...")
+    return extract_taxonomy_tags_for_texts([text_content])[0]
+
+def _cluster_embeddings(embeddings):
+    """
+    Groups semantically similar texts with KMeans (k ~ sqrt(N)).
+
+    Returns:
+        dict: cluster label -> (representative index, [member indices]), where the representative
+              is the member closest to the cluster centroid.
+    """
+    n_clusters = max(1, min(len(embeddings), round(math.sqrt(len(embeddings)))))
+    if n_clusters == 1:
+        return {0: (0, list(range(len(embeddings))))}
+    from sklearn.cluster import KMeans # Slow to import and only needed here
+
+    kmeans = KMeans(n_clusters=n_clusters, n_init="auto", random_state=0)
+    distances = kmeans.fit_transform(np.asarray(embeddings, dtype=np.float32))
+    clusters = {}
+    for index, label in enumerate(kmeans.labels_.tolist()):
+        clusters.setdefault(label, []).append(index)
+    return {
+        label: (min(members, key=lambda i: distances[i, label]), members)
+        for label, members in clusters.items()
+    }
+
+def _build_question_prompt_prefix(representative_text):
+    """Prompt prefix shared by every question of a cluster, prefilled once per cluster."""
+    return (
+        "You are analyzing quiz questions that are all similar to the following one:\n"
+        f"{representative_text}\n"
+        "For the question below, provide solution steps, its Bloom's Taxonomy level and taxonomy tags.\n"
+    )
+
+# Set LLM_PREFIX_CACHE=1 once `_prefill_prompt` is backed by an LLM that reuses the prefilled KV-cache;
+# until then, clustering questions to share a prefill only adds KMeans time to analyze_questions_batch.
+LLM_SUPPORTS_PREFIX_CACHE = os.getenv("LLM_PREFIX_CACHE") == "1"
+
+def _analyze_question_from_prefix(llm_session, question, embedding, tags):
+    """
+    Analyzes one question, decoding from a cluster's prefilled `llm_session` when there is one.
+    (Placeholder - the dummy heuristics below ignore the session)
+    """
+    # Decode per question from the shared prefix, e.g.
+    # my_finetuned_llm.generate(question['text'], context=llm_session)
+    return {
+        "question_id": question['id'],
+        "embedding": embedding,
+        "cognitive_level": classify_bloom_level_for_question(question['text'], question.get('answers')),
+        "solution_steps": generate_solution_steps_for_question(
+            question['text'], question['type'], question.get('answers')
+        ),
+        "taxonomy": tags
+    }
+
+def analyze_questions_batch(questions):
+    """
+    Analyzes many questions (e.g. all questions of a quiz) at once.
+
+    When the LLM supports prefix caching, questions are clustered by embedding and the prefill of a
+    shared prompt prefix is done once per cluster; decoding for each member then forks from that
+    cluster's KV-cache instead of prefilling its own overlapping prompt.
+
+    Args:
+        questions (list): Dicts with 'id', 'text', 'type' and optional 'answers'.
+
+    Returns:
+        list: One analysis dict per question, in input order.
+    """
+    logger.info(f"Analyzing a batch of {len(questions)} questions.")
+    texts = [question['text'] for question in questions]
+    # Batched model calls go through the shared LLM worker pool, like every other endpoint
+    embeddings, tags = run_concurrently(a_generate_embeddings(texts), a_extract_tags(texts))
+
+    if LLM_SUPPORTS_PREFIX_CACHE:
+        groups = [
+            (_prefill_prompt(_build_question_prompt_prefix(texts[representative])), members)
+            for representative, members in _cluster_embeddings(embeddings).values()
+        ]
+    else:
+        groups = [(None, range(len(questions)))]
+
+    results = [None] * len(questions)
+    for llm_session, members in groups:
+        for i in members:
+            results[i] = _analyze_question_from_prefix(llm_session, questions[i], embeddings[i], tags[i])
+    return results
+
+def retrieve_graphrag_context(attempt_data, course_context):
+    """
+    Retrieves course material relevant to the attempt's questions from the knowledge graph.
+    Only depends on the attempt itself, so it can run concurrently with Knowledge Tracing.
+    (Placeholder - implement with your GraphRAG retrieval script)
+    """
+    question_ids = [r.get('question_id') for r in attempt_data.get('responses', [])]
+    logger.info(f"Retrieving GraphRAG context for course {course_context.get('course_id')}, questions {question_ids}")
+    # graphrag_retrieved_info = my_graphrag_script.retrieve_relevant_info(question_ids=question_ids)
+    return ""
+
+def submit_graphrag_retrieval(attempt_data, course_context):
+    """
+    Starts `retrieve_graphrag_context` on the retrieval worker pool and returns a Future,
+    so retrieval overlaps with Knowledge Tracing and the LLM prefill of the prompt prefix.
+    """
+    return _RETRIEVAL_EXECUTOR.submit(retrieve_graphrag_context, attempt_data, course_context)
+
+def _build_feedback_prompt_prefix(attempt_data, student_kt_state):
+    """The part of the feedback prompt that does not depend on GraphRAG retrieval."""
+    prompt = f"Student (User ID: {student_kt_state.get('user_id')}) attempted quiz (Attempt ID: {attempt_data.get('attemptid')}).\n"
+    prompt += f"Responses: {attempt_data.get('responses')}\n"
+    prompt += f"Knowledge Tracing indicates they are struggling with: {student_kt_state.get('concepts_struggling')}.\n"
+    return prompt
+
+def _build_feedback_prompt_suffix(graphrag_context):
+    """The retrieval-dependent tail of the feedback prompt, fed to the LLM as a continuation."""
+    prompt = f"Relevant information: {graphrag_context}\n" if graphrag_context else ""
+    prompt += "Based on this and relevant course materials (retrieved via GraphRAG), provide personalized feedback and suggest next steps."
+    return prompt
+
+def _prefill_prompt(prompt_prefix):
+    """
+    Submits the static prompt prefix to the LLM for prefill and returns a handle to the resulting KV-cache.
+    (Placeholder - e.g. Ollama's returned `context`, llama.cpp `cache_prompt`, or HF `past_key_values`)
+    """
+    logger.info(f"Prefilling prompt prefix ({len(prompt_prefix)} chars).")
+    # return my_finetuned_llm.prefill(prompt_prefix)
+    return {"prompt": prompt_prefix}
+
+def stream_feedback_with_graphrag_llm(attempt_data, student_kt_state, course_context, graphrag_context=None):
+    """
+    Generates personalized feedback using GraphRAG and an LLM, yielding text chunks as the LLM emits them.
     (Placeholder - implement with your GraphRAG script and LLM calls)
 
+    GraphRAG retrieval is pipelined with the LLM: the retrieval-independent prompt prefix is prefilled
+    while retrieval is still running, and the retrieved text is fed in as a continuation once it lands.
+
     Args:
         attempt_data (dict): Data about the current attempt (e.g., responses).
         student_kt_state (dict): Output from the Knowledge Tracing model.
         course_context (dict): Relevant context from the course (e.g., learning objectives, related content).
-    
-    Returns:
-        str: The generated feedback text.
+        graphrag_context (str | Future, optional): Retrieved context, or the Future returned by
+            `submit_graphrag_retrieval`. Retrieval is started here if not given.
+
+    Yields:
+        str: Successive chunks of the generated feedback text.
     """
     logger.info(f"Generating feedback with GraphRAG/LLM for attempt ID: {attempt_data.get('attemptid')}")
     logger.info(f"Student KT State: {student_kt_state}")
     logger.info(f"Course Context (simplified): {course_context.get('course_id')}")
 
     # --- Placeholder for your GraphRAG and LLM interaction ---
-    # 1. Construct a prompt for the LLM. This prompt should include:
+    # The prompt includes:
     #    - The student's responses from `attempt_data`.
     #    - The student's knowledge state from `student_kt_state`.
     #    - Relevant information retrieved by GraphRAG based on the question(s), student's struggles, etc.
     #      (e.g., links to relevant course materials, definitions of concepts).
     #
-    # Example prompt construction (very simplified):
-    prompt = f"Student (User ID: {student_kt_state.get('user_id')}) attempted quiz (Attempt ID: {attempt_data.get('attemptid')}).\n"
-    prompt += f"Responses: {attempt_data.get('responses')}\n"
-    prompt += f"Knowledge Tracing indicates they are struggling with: {student_kt_state.get('concepts_struggling')}.\n"
-    prompt += "Based on this and relevant course materials (retrieved via GraphRAG), provide personalized feedback and suggest next steps."
+    # 1. Make sure GraphRAG retrieval is in flight before touching the LLM
+    if graphrag_context is None:
+        graphrag_context = submit_graphrag_retrieval(attempt_data, course_context)
 
-    # 2. (Simulate GraphRAG retrieval)
-    #    graphrag_retrieved_info = my_graphrag_script.retrieve_relevant_info(
-    #        concepts=student_kt_state.get('concepts_struggling'),
-    #        question_ids=[r.get('question_id') for r in attempt_data.get('responses', [])]
-    #    )
-    #    prompt += f"\nRelevant information: {graphrag_retrieved_info}"
+    # 2. Prefill the static prefix (student info, KT summary) while retrieval runs
+    llm_session = _prefill_prompt(_build_feedback_prompt_prefix(attempt_data, student_kt_state))
 
+    # 3. Wait for retrieval, then continue from the prefilled KV-cache with the retrieval-dependent suffix
+    if isinstance(graphrag_context, Future):
+        graphrag_context = graphrag_context.result()
+    prompt_suffix = _build_feedback_prompt_suffix(graphrag_context)
 
-    # 3. Call your fine-tuned LLM with the prompt.
-    #    llm_response = my_finetuned_llm.generate(prompt)
-    #    feedback_text = llm_response.text
+    # 4. Continue generation from the prefilled prefix, yielding chunks as they arrive
+    yield from _generate_feedback_chunks(llm_session, prompt_suffix, attempt_data, student_kt_state)
+
+def _generate_feedback_chunks(llm_session, prompt_suffix, attempt_data, student_kt_state):
+    """
+    Streams the LLM's feedback, continuing from the prefilled `llm_session` with `prompt_suffix`.
+    (Placeholder - the dummy text below ignores the session and suffix)
+    """
+    # Call your fine-tuned LLM in streaming mode and yield chunks as they arrive.
+    #    for chunk in my_finetuned_llm.generate(prompt_suffix, context=llm_session, stream=True):
+    #        yield chunk.text
 
     # Dummy feedback section
     attempt_id = attempt_data.get('attemptid')
@@ -130,8 +536,21 @@ def generate_feedback_with_graphrag_llm(attempt_data, student_kt_state, course_c
         feedback_parts.append(f"You might need to review {concepts_struggling}.")
     
     feedback_parts.append("Consider revisiting relevant materials or practice problems. Keep up the good work!")
-    
-    feedback_text = " ".join(feedback_parts)
+
+    for i, part in enumerate(feedback_parts):
+        yield part if i == 0 else " " + part
+
+def generate_feedback_with_graphrag_llm(attempt_data, student_kt_state, course_context, graphrag_context=None):
+    """
+    Generates personalized feedback using GraphRAG and an LLM.
+    Non-streaming variant of `stream_feedback_with_graphrag_llm`.
+
+    Returns:
+        str: The generated feedback text.
+    """
+    feedback_text = "".join(
+        stream_feedback_with_graphrag_llm(attempt_data, student_kt_state, course_context, graphrag_context)
+    )
     # Use the logger you've configured for your Flask app
     # If using app.logger, you might need to pass 'app' or 'logger' to this function
     # For simplicity, assuming a module-level logger or print for now if app.logger isn't directly available
@@ -143,33 +562,116 @@ def generate_feedback_with_graphrag_llm(attempt_data, student_kt_state, course_c
         
     return feedback_text
 
+def _summarize_texts(texts):
+    """
+    Generates summaries for a batch of texts.
+    (Placeholder - implement with your summarization model)
+    """
+    logger.info(f"Summarizing {len(texts)} text(s) in one batch.")
+    # Dummy implementation
+    return [f"This is a summary of: {text_content[:100]}..." for text_content in texts]
+
+def summarize_contents(texts):
+    """
+    Generates summaries for a list of texts, batching all cache misses.
+    """
+    return _lookup_or_compute(_SUMMARY_CACHE, texts, _summarize_texts)
+
 def summarize_content(text_content):
     """
     Generates a summary for text content.
-    (Placeholder - implement with your summarization model)
     """
     logger.info(f"Summarizing content: {text_content[:50]}...")
-    # Dummy implementation
-    return f"This is a summary of: {text_content[:100]}..."
+    return summarize_contents([text_content])[0]
+
+# Metadata kind -> ID field of its items, for update_graph_with_new_data.
+_GRAPH_ITEM_ID_FIELDS = {"bookchapters": "chapterid", "h5pactivities": "h5pid", "questions": "question_id"}
+
+def _graph_item_hash(item):
+    """
+    Content hash of an analyzed item over its ID, summary, taxonomy and other analysis fields.
+    The embedding is left out: it is derived from the same content, and its wire form (float list,
+    int8 or base64) and float noise would otherwise make an unchanged item look changed.
+    """
+    content = {field: value for field, value in item.items() if field != "embedding"}
+    payload = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
 
 def update_graph_with_new_data(course_id, analyzed_content_metadata, analyzed_question_metadata):
     """
     Updates the knowledge graph using GraphRAG scripts with new analyzed data.
+    Only items added, changed or removed since the last update for the course are sent to GraphRAG,
+    based on the content hashes recorded by graph_state_service.
     (Placeholder - implement with your GraphRAG update script)
     """
     logger.info(f"Initiating knowledge graph update for course ID {course_id} using GraphRAG.")
-    # This is where you would call your GraphRAG indexing/update scripts.
+    metadata_by_kind = {
+        "bookchapters": analyzed_content_metadata.get('bookchapters', []),
+        "h5pactivities": analyzed_content_metadata.get('h5pactivities', []),
+        "questions": analyzed_question_metadata or []
+    }
+    items = {}
+    for kind, kind_items in metadata_by_kind.items():
+        id_field = _GRAPH_ITEM_ID_FIELDS[kind]
+        for item in kind_items:
+            item_id = item.get(id_field, item.get('id'))
+            if item_id is not None:
+                items[f"{kind}:{item_id}"] = item
+    item_hashes = {key: _graph_item_hash(item) for key, item in items.items()}
+    # A kind with no items in this sync was most likely not sent at all, so none of its stored items count as removed
+    sent_kinds = {kind for kind, kind_items in metadata_by_kind.items() if kind_items}
+    added, changed, removed = diff_course_items(course_id, item_hashes, sent_kinds)
+
+    # This is where you would call your GraphRAG indexing/update scripts with only the deltas.
     # Example:
     # graph_rag_updater.update_course_graph(
     #     course_id=course_id,
-    #     new_content_nodes=analyzed_content_metadata, # e.g., list of dicts from analyze_course_content
-    #     new_question_nodes=analyzed_question_metadata # e.g., list of dicts from analyze_question
+    #     added_nodes=[items[key] for key in added],
+    #     changed_nodes=[items[key] for key in changed],
+    #     removed_node_ids=removed # e.g., "bookchapters:12"
     # )
+    save_course_items(course_id, item_hashes, removed)
+
     message = f"GraphRAG update process simulated for course ID {course_id}. "
-    message += f"Received {len(analyzed_content_metadata.get('bookchapters', []))} book chapters, "
-    message += f"{len(analyzed_content_metadata.get('h5pactivities', []))} H5P activities, "
-    # Assuming analyzed_question_metadata would be a list of question analysis results if batched
-    # For now, let's assume it's not directly passed in this simplified version, or passed differently.
-    # message += f"and {len(analyzed_question_metadata)} questions."
+    message += f"Received {len(metadata_by_kind['bookchapters'])} book chapters, "
+    message += f"{len(metadata_by_kind['h5pactivities'])} H5P activities, "
+    message += f"and {len(metadata_by_kind['questions'])} questions. "
+    message += f"Graph delta: {len(added)} added, {len(changed)} changed, {len(removed)} removed, "
+    message += f"{len(item_hashes) - len(added) - len(changed)} unchanged."
     logger.info(message)
-    return message
\ No newline at end of file
+    return message
+
+# --- Startup warmup ---
+
+# Extra texts whose embeddings, tags and summaries are precomputed at startup, separated by '|'.
+WARMUP_TEXTS = [text for text in os.getenv("LLM_WARMUP_TEXTS", "").split("|") if text.strip()]
+
+def warmup():
+    """
+    Loads the models and runs each one once before the server accepts requests, so the first
+    request does not pay model-load latency. Also precomputes results for WARMUP_TEXTS into the LRU caches.
+    """
+    texts = ["warmup"] + WARMUP_TEXTS
+    logger.info(f"Warming up models with {len(texts)} text(s).")
+    generate_embeddings_for_texts(texts)
+    extract_taxonomy_tags_for_texts(texts)
+    summarize_contents(texts)
+    classify_bloom_level_for_question("warmup", None)
+    generate_solution_steps_for_question("warmup", "essay", None)
+
+# --- Async variants (run the blocking calls on the shared LLM worker pool) ---
+
+async def a_generate_solution_steps(question_text, question_type, answers):
+    return await _run_in_llm_executor(generate_solution_steps_for_question, question_text, question_type, answers)
+
+async def a_classify_bloom_level(question_text, answers):
+    return await _run_in_llm_executor(classify_bloom_level_for_question, question_text, answers)
+
+async def a_generate_embeddings(texts):
+    return await _run_in_llm_executor(generate_embeddings_for_texts, texts)
+
+async def a_extract_tags(texts):
+    return await _run_in_llm_executor(extract_taxonomy_tags_for_texts, texts)
+
+async def a_summarize_contents(texts):
+    return await _run_in_llm_executor(summarize_contents, texts)